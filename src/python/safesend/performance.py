@@ -1,18 +1,20 @@
 import matplotlib.pyplot as plt
-import csv
+import pandas as pd
 
 def analyze_logs(log_file_path):
-    times = []
-    throughput = []
-    retransmissions = []
-
-    with open(log_file_path, "r") as log_file:
-        reader = csv.reader(log_file)
-        for row in reader:
-            if row[0] == "STATS":
-                times.append(float(row[1]))
-                throughput.append(float(row[2]))
-                retransmissions.append(float(row[3]))
+    # One vectorized pass over the log: pandas' C engine parses orders of
+    # magnitude faster than the row-at-a-time csv module, and the float
+    # conversions happen once as column casts instead of per cell.
+    df = pd.read_csv(
+        log_file_path,
+        header=None,
+        names=["tag", "time", "throughput", "retransmissions"],
+        engine="c",
+    )
+    stats = df[df["tag"] == "STATS"]
+    times = stats["time"].astype(float)
+    throughput = stats["throughput"].astype(float)
+    retransmissions = stats["retransmissions"].astype(float)
 
     # Plot throughput vs time
     plt.plot(times, throughput, label="Throughput (Bps)")
@@ -29,4 +31,3 @@ def analyze_logs(log_file_path):
     plt.title("Retransmissions vs Time")
     plt.legend()
     plt.show()
-
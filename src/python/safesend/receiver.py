@@ -1,15 +1,33 @@
 # src/python/safesend/receiver.py
-import argparse, os, socket, struct, threading
+import argparse, asyncio, hashlib, os, struct, time
 from pathlib import Path
-from .protocol import DEFAULT_PORT, PROTOCOL_VERSION
-from .util.crc32 import crc32_bytes
-from .util.hashing import sha256_file
-from .malware_scan import scan_file
+from .protocol import (CHUNK_SIZE, DEFAULT_PORT, LEGACY_CHUNK_SIZE,
+                       MAX_CHUNK_SIZE, PROTOCOL_VERSION)
+from .util.crc32 import crc32_update
+from .util.netio import tune_transfer_socket
+from .services import verify_service
 
 ENC = "utf-8"
 CHUNK_HDR_FMT = "!4s I Q I I"    # "CHNK", seq, offset, length, crc32
-CHUNK_HDR_SIZE = struct.calcsize(CHUNK_HDR_FMT)
 ACK_FMT = "!4s I"                # "ACK!", seq
+# Compiled once: Struct objects skip the per-call format re-parse in the hot loop
+_HDR = struct.Struct(CHUNK_HDR_FMT)
+_ACK = struct.Struct(ACK_FMT)
+CHUNK_HDR_SIZE = _HDR.size
+
+# Frame tags as big-endian ints: one from_bytes per frame and an integer
+# dict lookup picks the handler, instead of cascaded bytes compares.
+_TAG_CHNK = int.from_bytes(b"CHNK", "big")
+_TAG_DONE = int.from_bytes(b"DONE", "big")
+
+# Stream buffer for each connection; large enough to hold several chunks so
+# the transport isn't paused/resumed on every frame.
+STREAM_LIMIT = 4 * CHUNK_SIZE
+
+# Payload arrives in pieces of this size so the CRC folds over each piece
+# while the next one is still in flight, instead of one full-chunk pass
+# after the last byte lands.
+_CRC_PIECE = 64 * 1024
 
 STATE_DIR = Path("data/incoming")    # store partials & state
 RECEIVED_DIR = Path("data/received")
@@ -18,19 +36,15 @@ STATE_DIR.mkdir(parents=True, exist_ok=True)
 RECEIVED_DIR.mkdir(parents=True, exist_ok=True)
 QUAR_DIR.mkdir(parents=True, exist_ok=True)
 
-def send_line(sock: socket.socket, line: str):
-    sock.sendall((line + "\n").encode(ENC))
+async def send_line(writer: asyncio.StreamWriter, line: str):
+    writer.write((line + "\n").encode(ENC))
+    await writer.drain()
 
-def recv_line(sock: socket.socket) -> str:
-    buf = b""
-    while True:
-        ch = sock.recv(1)
-        if not ch:
-            raise ConnectionError("Socket closed while reading line")
-        if ch == b"\n":
-            break
-        buf += ch
-    return buf.decode(ENC).rstrip("\r")
+async def recv_line(reader: asyncio.StreamReader) -> str:
+    line = await reader.readline()
+    if not line.endswith(b"\n"):
+        raise ConnectionError("Socket closed while reading line")
+    return line.decode(ENC).rstrip("\r\n")
 
 def state_paths(filename: str):
     """
@@ -55,157 +69,319 @@ def read_resume_offset(st_path: Path) -> int:
 def write_resume_offset(st_path: Path, offset: int):
     st_path.write_text(str(offset), encoding="utf-8")
 
-def handle_client(conn: socket.socket, addr):
+STATE_FLUSH_CHUNKS = 16       # persist every 16 chunks (1 MiB at 64 KiB chunks)
+STATE_FLUSH_INTERVAL = 0.1    # ... or at least every 100 ms
+
+class ResumeState:
+    """
+    Batched persistence of the resume offset.
+
+    Writing the state file per chunk means tens of thousands of
+    open/write/close cycles per second at line rate, all serializing on
+    filesystem metadata. Keep one fd open, track the offset in memory, and
+    flush (pwrite + fdatasync) every STATE_FLUSH_CHUNKS chunks or
+    STATE_FLUSH_INTERVAL seconds. After a crash the resume point is at worst
+    one batch behind -- still safe, the sender just re-sends from there.
+    """
+
+    def __init__(self, path: Path):
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        self._offset = None
+        self._dirty = 0
+        self._last_flush = time.monotonic()
+
+    def update(self, offset: int):
+        self._offset = offset
+        self._dirty += 1
+        if (self._dirty >= STATE_FLUSH_CHUNKS
+                or time.monotonic() - self._last_flush >= STATE_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        if self._offset is not None:
+            data = str(self._offset).encode("utf-8")
+            os.pwrite(self._fd, data, 0)
+            os.ftruncate(self._fd, len(data))
+            os.fdatasync(self._fd)
+        self._dirty = 0
+        self._last_flush = time.monotonic()
+
+    def close(self, flush: bool = True):
+        if self._fd is None:
+            return
+        if flush and self._dirty:
+            self.flush()
+        os.close(self._fd)
+        self._fd = None
+
+def _hash_prefix(hasher, fd: int, upto: int) -> int:
+    """Feed the first `upto` on-disk bytes to the hasher; returns bytes hashed."""
+    pos = 0
+    while pos < upto:
+        block = os.pread(fd, min(1024 * 1024, upto - pos), pos)
+        if not block:
+            break
+        hasher.update(block)
+        pos += len(block)
+    return pos
+
+def _preallocate(fd: int, size: int):
+    """Reserve the full target size up front so the filesystem can lay the
+    file out in contiguous extents instead of growing it chunk by chunk."""
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return
     try:
-        # ---- Control: HELLO
-        hello = recv_line(conn)
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        pass  # e.g. filesystem without fallocate support; writes still work
+
+async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    addr = writer.get_extra_info("peername")
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        tune_transfer_socket(sock)
+    print("[recv] connection from", addr)
+    loop = asyncio.get_running_loop()
+    resume_state = None
+    try:
+        # ---- Control: HELLO [<chunksize>]
+        hello = await recv_line(reader)
         if not hello.startswith("HELLO "):
-            send_line(conn, "ERR bad HELLO")
+            await send_line(writer, "ERR bad HELLO")
             return
-        version = int(hello.split()[1])
+        hello_parts = hello.split()
+        version = int(hello_parts[1])
         if version != PROTOCOL_VERSION:
-            send_line(conn, f"ERR version_mismatch server={PROTOCOL_VERSION}")
+            await send_line(writer, f"ERR version_mismatch server={PROTOCOL_VERSION}")
+            return
+        # Senders announce their chunk size; older peers omit it and still
+        # use the legacy 64 KiB.
+        chunk_size = int(hello_parts[2]) if len(hello_parts) > 2 else LEGACY_CHUNK_SIZE
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            await send_line(writer, f"ERR bad chunksize max={MAX_CHUNK_SIZE}")
             return
 
         # ---- Control: RESUME?
-        resume_q = recv_line(conn)
+        resume_q = await recv_line(reader)
         if not resume_q.startswith("RESUME? "):
-            send_line(conn, "ERR expected RESUME?")
+            await send_line(writer, "ERR expected RESUME?")
             return
         filename = resume_q.split(maxsplit=1)[1]
         partial_path, state_path, meta_path = state_paths(filename)
         start_offset = read_resume_offset(state_path)
-        send_line(conn, f"RESUME {start_offset}")
+        await send_line(writer, f"RESUME {start_offset}")
 
         # ---- Control: META
-        meta = recv_line(conn)
+        meta = await recv_line(reader)
         # META <filename> <size> <sha256>
         if not meta.startswith("META "):
-            send_line(conn, "ERR expected META")
+            await send_line(writer, "ERR expected META")
             return
         _, r_fname, r_size, r_sha = meta.split()
         expect_size = int(r_size)
 
-        # Make sure partial file exists and is correct length if resuming
+        # Raw fd: chunk writes go through os.pwrite at their offset, so there
+        # is no seek and no user-space buffering to flush.
         partial_path.parent.mkdir(parents=True, exist_ok=True)
-        mode = "r+b" if partial_path.exists() else "w+b"
-        with open(partial_path, mode) as out_f:
-            if start_offset and out_f.seek(0, 2) < start_offset:
+        out_fd = os.open(partial_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if start_offset and os.fstat(out_fd).st_size < start_offset:
                 # Partial is shorter than resume point; reset to 0
-                out_f.truncate(0)
+                os.ftruncate(out_fd, 0)
                 write_resume_offset(state_path, 0)
                 start_offset = 0
 
-            send_line(conn, "READY")
+            _preallocate(out_fd, expect_size)
+
+            # Hash incrementally as chunks arrive instead of re-reading the
+            # whole file at DONE. On resume, catch the hash up over the bytes
+            # already on disk first (off-loop: it can be a big sequential read).
+            hasher = hashlib.sha256()
+            hashed_upto = 0
+            if start_offset:
+                hashed_upto = await loop.run_in_executor(
+                    None, _hash_prefix, hasher, out_fd, start_offset)
+
+            await send_line(writer, "READY")
 
             # ---- Data path: receive chunks until DONE
+            resume_state = ResumeState(state_path)
             last_acked = -1
-            while True:
-                # Peek text line for DONE? We cannot mix; rely on "DONE" as a line.
-                conn.settimeout(0.001)
-                try:
-                    # Non-blocking peek for newline delimiter; if not present, continue with binary read.
-                    pass
-                except Exception:
-                    pass
-                finally:
-                    conn.settimeout(None)
-
-                # Read chunk header (or try a line to detect DONE)
-                # Strategy: try to read 4 bytes; if they decode to "DONE" line soon, handle DONE.
-                # Simpler: use a small recv peek to check if next is 'D' (68). If so, read a line.
-                peek = conn.recv(1, socket.MSG_PEEK)
-                if not peek:
-                    break
-                if peek == b"D":  # likely "DONE\n"
-                    line = recv_line(conn)
-                    if line == "DONE":
-                        # Verify SHA-256 & AV
-                        out_f.flush()
-                        # Ensure size matches intended (not required strictly, but helpful)
-                        final_size = out_f.seek(0, 2)
-                        if final_size != expect_size:
-                            print(f"[warn] size mismatch: got={final_size} expect={expect_size}")
-                        digest = sha256_file(partial_path)
-                        if digest != r_sha:
-                            print(f"[warn] SHA mismatch: got={digest} expect={r_sha}")
-                        infected, msg = scan_file(partial_path)
-                        if infected:
-                            dst = QUAR_DIR / filename
-                            if dst.exists():
-                                dst.unlink()
-                            partial_path.replace(dst)
-                            send_line(conn, "DONE_OK")  # still reply OK so sender completes
-                            print(f"[quarantine] {dst} :: {msg}")
-                        else:
-                            dst = RECEIVED_DIR / filename
-                            if dst.exists():
-                                dst.unlink()
-                            partial_path.replace(dst)
-                            print(f"[clean] received {dst} sha256={digest}")
-                            # Clean up state on success
-                            if state_path.exists():
-                                state_path.unlink(missing_ok=True)
-                            if meta_path.exists():
-                                meta_path.unlink(missing_ok=True)
-                            send_line(conn, "DONE_OK")
-                        return
-
-                # Otherwise, read a CHNK
-                header = conn.recv(CHUNK_HDR_SIZE)
-                if not header:
-                    break
-                tag, seq, offset, length, crc = struct.unpack(CHUNK_HDR_FMT, header)
-                if tag != b"CHNK":
-                    # Unexpected—ignore and continue
-                    continue
-
-                # Receive payload
-                remaining = length
-                payload = b""
-                while remaining > 0:
-                    chunk = conn.recv(min(65536, remaining))
-                    if not chunk:
-                        raise ConnectionError("Socket closed mid-payload")
-                    payload += chunk
-                    remaining -= len(chunk)
-
-                calc = crc32_bytes(payload)
+            contig_upto = start_offset   # highest contiguous byte written
+
+            # Per-chunk interpreter overhead matters at 10k+ chunks/s; hoist
+            # every hot attribute lookup out of the loop so each iteration is
+            # locals-only glue around the syscalls.
+            readexactly = reader.readexactly
+            read = reader.read
+            ack_write = writer.write
+            drain = writer.drain
+            hdr_unpack = _HDR.unpack
+            ack_pack = _ACK.pack
+            hash_update = hasher.update
+            state_update = resume_state.update
+            pwrite = os.pwrite
+            crc32 = crc32_update
+            hdr_rest = CHUNK_HDR_SIZE - 4
+
+            # One payload buffer per connection, sized to the negotiated
+            # chunk; pieces scatter into it as they arrive and the write/
+            # hash below take zero-copy views of it.
+            recv_buf = bytearray(chunk_size)
+            recv_mv = memoryview(recv_buf)
+
+            # Frame handlers: each returns True when the connection is finished.
+            async def _read_done():
+                await reader.readline()  # consume the rest of the "DONE\n" line
+                # Verify SHA-256 & AV
+                # Ensure size matches intended (not required strictly, but helpful)
+                final_size = os.fstat(out_fd).st_size
+                if final_size != expect_size:
+                    print(f"[warn] size mismatch: got={final_size} expect={expect_size}")
+                # Scan (and any fallback digest) run on the shared verify
+                # pool; awaiting the wrapped futures keeps the loop free
+                # for other transfers.
+                scan_future = asyncio.wrap_future(
+                    verify_service.submit_scan(partial_path))
+                if hashed_upto == final_size:
+                    digest = hasher.hexdigest()
+                else:
+                    # The running hash lost sync (e.g. non-contiguous
+                    # writes); fall back to one full read.
+                    digest = await asyncio.wrap_future(
+                        verify_service.submit_digest(partial_path))
+                if digest != r_sha:
+                    print(f"[warn] SHA mismatch: got={digest} expect={r_sha}")
+                infected, msg = await scan_future
+                if infected:
+                    dst = QUAR_DIR / filename
+                    if dst.exists():
+                        dst.unlink()
+                    partial_path.replace(dst)
+                    await send_line(writer, "DONE_OK")  # still reply OK so sender completes
+                    print(f"[quarantine] {dst} :: {msg}")
+                else:
+                    dst = RECEIVED_DIR / filename
+                    if dst.exists():
+                        dst.unlink()
+                    partial_path.replace(dst)
+                    print(f"[clean] received {dst} sha256={digest}")
+                    # Clean up state on success
+                    if state_path.exists():
+                        state_path.unlink(missing_ok=True)
+                    if meta_path.exists():
+                        meta_path.unlink(missing_ok=True)
+                    await send_line(writer, "DONE_OK")
+                return True
+
+            async def _read_chunk():
+                nonlocal last_acked, hashed_upto, contig_upto
+                # Rest of the CHNK header, then the payload
+                header = b"CHNK" + await readexactly(hdr_rest)
+                _, seq, offset, length, crc = hdr_unpack(header)
+                if length > chunk_size:
+                    await send_line(writer, f"ERR chunk too large max={chunk_size}")
+                    return True
+                # Fused receive+CRC: read the payload in pieces, scatter each
+                # into the chunk buffer and fold it into the running CRC
+                # right away. The checksum work overlaps the socket waits for
+                # the rest of the chunk instead of running after it.
+                got = 0
+                calc = 0
+                while got < length:
+                    part = await read(min(_CRC_PIECE, length - got))
+                    if not part:
+                        raise ConnectionError("Socket closed mid-chunk")
+                    n = len(part)
+                    recv_mv[got:got + n] = part
+                    calc = crc32(part, calc)
+                    got += n
+                payload = recv_mv[:length]
+
                 if calc != crc:
-                    # Corruption: we do NOT write it; we re-ACK the last good seq to force retransmit
-                    conn.sendall(struct.pack(ACK_FMT, b"ACK!", last_acked if last_acked >= 0 else 0xFFFFFFFF))
-                    continue
+                    # Corruption: we do NOT write it; an explicit NACK makes
+                    # the sender rewind its window immediately.
+                    ack_write(ack_pack(b"ACK!", 0xFFFFFFFF))
+                    await drain()
+                    return False
 
-                # Write chunk at the given offset
-                out_f.seek(offset)
-                out_f.write(payload)
-                last_acked = seq
+                if offset > contig_upto:
+                    # A dropped (CRC-failed) chunk left a hole before this
+                    # one. ACKs are strictly cumulative: ACKing this seq
+                    # would tell the sender the hole was covered, so discard
+                    # it and re-ACK the last in-order seq until the sender's
+                    # rewind refills the gap.
+                    ack_write(ack_pack(b"ACK!", last_acked if last_acked >= 0 else 0xFFFFFFFF))
+                    await drain()
+                    return False
 
-                # Persist resume point for safety (highest contiguous offset)
-                # NOTE: stop-and-wait means offset increases monotonically
-                write_resume_offset(state_path, offset + length)
+                # Positional write at the chunk offset (page-cache write;
+                # fast enough to stay on-loop, and no seek syscall)
+                pwrite(out_fd, payload, offset)
+                end = offset + length
+                if end > contig_upto:
+                    contig_upto = end
+                    last_acked = seq
+
+                # Advance the running hash over contiguous bytes; duplicates
+                # (retransmits) re-carry identical data and are skipped.
+                if offset == hashed_upto:
+                    hash_update(payload)
+                    hashed_upto = offset + length
+
+                # Persist resume point for safety (highest contiguous written
+                # offset, flushed in batches); the post-gap discard above is
+                # what keeps this an on-disk invariant, since skipping a
+                # CRC-failed chunk breaks the stream's offset monotonicity.
+                state_update(contig_upto)
 
                 # ACK the received seq
-                conn.sendall(struct.pack(ACK_FMT, b"ACK!", seq))
+                ack_write(ack_pack(b"ACK!", seq))
+                await drain()
+                return False
+
+            async def _read_err():
+                await send_line(writer, "ERR bad frame tag")
+                return True
+
+            handler = {_TAG_CHNK: _read_chunk, _TAG_DONE: _read_done}.get
+
+            while True:
+                # Every frame starts with a 4-byte tag: "CHNK" for a binary
+                # chunk header, "DONE" for the final control line.
+                try:
+                    tag = int.from_bytes(await readexactly(4), "big")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if await handler(tag, _read_err)():
+                    return
+        finally:
+            os.close(out_fd)
 
     except Exception as e:
         print("[error]", e)
     finally:
+        if resume_state is not None:
+            resume_state.close()
         try:
-            conn.close()
+            writer.close()
+            await writer.wait_closed()
         except Exception:
             pass
 
+async def _serve(port: int):
+    server = await asyncio.start_server(handle_client, port=port, limit=STREAM_LIMIT)
+    print(f"[recv] listening on 0.0.0.0:{port}")
+    async with server:
+        await server.serve_forever()
+
 def run_server(port: int):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
-        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        srv.bind(("", port))
-        srv.listen(8)
-        print(f"[recv] listening on 0.0.0.0:{port}")
-        while True:
-            conn, addr = srv.accept()
-            print("[recv] connection from", addr)
-            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass  # stdlib event loop is fine, uvloop is just faster
+    asyncio.run(_serve(port))
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
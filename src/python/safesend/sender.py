@@ -1,34 +1,31 @@
 # src/python/safesend/sender.py
-import argparse, os, socket, struct, time
+import argparse, mmap, os, selectors, socket, struct, time
 from pathlib import Path
 from .protocol import CHUNK_SIZE, DEFAULT_PORT, PROTOCOL_VERSION
 from .util.crc32 import crc32_bytes
 from .util.hashing import sha256_file
+from .util.netio import BufferedSocket, tune_transfer_socket
 
 CHUNK_HDR_FMT = "!4s I Q I I"    # "CHNK", seq, offset, length, crc32
-CHUNK_HDR_SIZE = struct.calcsize(CHUNK_HDR_FMT)
 ACK_FMT = "!4s I"                # "ACK!", seq
+# Compiled once: Struct objects skip the per-call format re-parse in the hot loop
+_HDR = struct.Struct(CHUNK_HDR_FMT)
+_ACK = struct.Struct(ACK_FMT)
+CHUNK_HDR_SIZE = _HDR.size
+ACK_SIZE = _ACK.size
 
 ENC = "utf-8"
 SOCKET_TIMEOUT = 5.0             # seconds
 RETX_TIMEOUT = 2.0               # retransmit wait
-WINDOW_SIZE = 1                  # stop-and-wait (simpler for week 1–2)
+WINDOW_SIZE = 64                 # chunks in flight (sliding window)
 
 def send_line(sock: socket.socket, line: str):
     sock.sendall((line + "\n").encode(ENC))
 
-def recv_line(sock: socket.socket) -> str:
-    buf = b""
-    while True:
-        ch = sock.recv(1)
-        if not ch:
-            raise ConnectionError("Socket closed while reading line")
-        if ch == b"\n":
-            break
-        buf += ch
-    return buf.decode(ENC).rstrip("\r")
-
-def handshake(sock: socket.socket, file_path: Path) -> int:
+def recv_line(reader: BufferedSocket) -> str:
+    return reader.readline().decode(ENC).rstrip("\r")
+
+def handshake(sock: socket.socket, reader: BufferedSocket, file_path: Path) -> int:
     """
     Returns start_offset for resume (0 if new).
     """
@@ -36,10 +33,10 @@ def handshake(sock: socket.socket, file_path: Path) -> int:
     digest = sha256_file(file_path)
     fname = file_path.name
 
-    send_line(sock, f"HELLO {PROTOCOL_VERSION}")
+    send_line(sock, f"HELLO {PROTOCOL_VERSION} {CHUNK_SIZE}")
     # Ask server if we should resume: server returns highest safe offset
     send_line(sock, f"RESUME? {fname}")
-    resume_line = recv_line(sock)
+    resume_line = recv_line(reader)
     # Expected: "RESUME <offset>" or "RESUME 0"
     if not resume_line.startswith("RESUME "):
         raise RuntimeError(f"Bad resume reply: {resume_line}")
@@ -49,7 +46,7 @@ def handshake(sock: socket.socket, file_path: Path) -> int:
     send_line(sock, f"META {fname} {size} {digest}")
 
     # Wait until server says READY
-    ready = recv_line(sock)
+    ready = recv_line(reader)
     if ready != "READY":
         raise RuntimeError(f"Expected READY, got: {ready}")
 
@@ -60,57 +57,202 @@ def send_file(host: str, port: int, file_path: str):
     size = file.stat().st_size
 
     with socket.create_connection((host, port), timeout=SOCKET_TIMEOUT) as s:
+        tune_transfer_socket(s)
+        reader = BufferedSocket(s)
+
         # 1) Handshake + resume probe
-        start_offset = handshake(s, file)
+        start_offset = handshake(s, reader, file)
 
-        seq = 0
-        offset = start_offset
         if start_offset:
             print(f"[resume] continuing from offset {start_offset:,}")
 
-        # 2) Seek and send chunks
-        with open(file, "rb") as f:
-            f.seek(start_offset)
-            while offset < size:
-                payload = f.read(CHUNK_SIZE)
-                if not payload:
-                    break
-
-                length = len(payload)
-                crc = crc32_bytes(payload)
-                header = struct.pack(
-                    CHUNK_HDR_FMT, b"CHNK", seq, offset, length, crc
-                )
-
-                # Send and wait for ACK (stop-and-wait; you can window later)
-                deadline = time.time() + RETX_TIMEOUT
-                while True:
-                    try:
-                        s.sendall(header + payload)
-                        # Block for ACK
-                        ack_tag, ack_seq = struct.unpack(ACK_FMT, s.recv(struct.calcsize(ACK_FMT)))
-                        if ack_tag != b"ACK!":
-                            raise RuntimeError("Bad ACK tag")
-                        if ack_seq != seq:
-                            # Unexpected seq; keep waiting briefly (or treat as error)
-                            continue
-                        # We are acked; move to next chunk
-                        break
-                    except (socket.timeout, TimeoutError):
-                        if time.time() > deadline:
-                            print(f"[retx] seq {seq} timed out; retransmitting")
-                            continue
-
-                seq += 1
-                offset += length
+        # 2) Pipelined chunk send (sliding window, Go-Back-N)
+        chunks = 0
+        if size:
+            with open(file, "rb") as f:
+                # mmap the file once: CRC reads page-cache bytes in place and
+                # sendfile DMAs them to the socket -- no user-space payload copy.
+                # ACCESS_COPY (not ACCESS_READ) because its views are writable,
+                # so ctypes can wrap them and the hardware CRC path applies;
+                # copy-on-write never triggers since we only read.
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) as mm:
+                    if hasattr(mmap, "MADV_SEQUENTIAL"):
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    chunks = _send_chunks(s, f, mm, size, start_offset)
 
         # 3) Signal completion
         send_line(s, "DONE")
-        done_reply = recv_line(s)
+        done_reply = recv_line(reader)
         if done_reply != "DONE_OK":
             raise RuntimeError(f"Server did not confirm DONE: {done_reply}")
 
-        print(f"[ok] sent {file.name} bytes={size:,} chunks={seq}")
+        print(f"[ok] sent {file.name} bytes={size:,} chunks={chunks}")
+
+def _build_chunk(hdr_buf: bytearray, mm_view: memoryview, seq: int, offset: int,
+                 length: int, _pack_into=_HDR.pack_into, _crc=crc32_bytes):
+    """
+    Fused per-chunk kernel: CRC the payload slice and pack the header into
+    the reused buffer in one call. The compiled Struct and the CRC routine
+    are bound as defaults so the hot path never goes through module globals.
+    """
+    _pack_into(hdr_buf, 0, b"CHNK", seq, offset, length,
+               _crc(mm_view[offset:offset + length]))
+
+def _prefetch(mm: mmap.mmap, offset: int, size: int):
+    """Ask the kernel to fault in the next couple of chunks ahead of the CRC."""
+    if not hasattr(mmap, "MADV_WILLNEED"):
+        return
+    start = offset & ~(mmap.PAGESIZE - 1)
+    length = min(2 * CHUNK_SIZE, size - start)
+    if length > 0:
+        try:
+            mm.madvise(mmap.MADV_WILLNEED, start, length)
+        except (OSError, ValueError):
+            pass
+
+def _send_payload(sock: socket.socket, f, mm_view: memoryview, offset: int, remaining: int) -> int:
+    """Push payload bytes starting at file offset; returns bytes accepted."""
+    if hasattr(os, "sendfile"):
+        # Zero-copy: page cache -> socket, payload never enters user space
+        return os.sendfile(sock.fileno(), f.fileno(), offset, remaining)
+    return sock.send(mm_view[offset:offset + remaining])
+
+def _send_chunks(sock: socket.socket, f, mm: mmap.mmap, size: int, start_offset: int) -> int:
+    """
+    Pipeline up to WINDOW_SIZE chunks on a non-blocking socket, reading ACKs
+    as they come back instead of stalling one RTT per chunk. Go-Back-N: a
+    stale/NACK ACK or a retransmit timeout rewinds to the oldest unacked
+    chunk. Payload bytes go kernel-to-kernel via sendfile(2); the mmap is
+    only touched to CRC each chunk. Returns the number of chunks sent.
+    """
+    sel = selectors.DefaultSelector()
+    sock.setblocking(False)
+    sel.register(sock, selectors.EVENT_READ)
+
+    # Cork the data phase (Linux) so each 24-byte header coalesces with its
+    # payload into MSS-sized segments instead of going out as a runt packet.
+    if hasattr(socket, "TCP_CORK"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+
+    mm_view = memoryview(mm)
+    hdr_buf = bytearray(CHUNK_HDR_SIZE)   # reused for every chunk header
+    hdr_view = memoryview(hdr_buf)
+    base_seq = 0                  # oldest unacked seq
+    base_offset = start_offset    # file offset matching base_seq
+    next_seq = 0
+    next_offset = start_offset
+    in_flight = {}                # seq -> (offset, length, send_time)
+    ack_buf = bytearray()
+    frames_sent = 0               # frames fully flushed; each elicits one reply
+    replies_seen = 0              # 8-byte reply frames parsed (ACKs and NACKs)
+    pending_hdr = None            # unflushed tail of the current chunk header
+    pending_off = 0               # file offset of unsent payload bytes
+    pending_rem = 0               # unsent payload bytes of the current chunk
+
+    def rewind():
+        # Restart from the window base. A partially flushed frame keeps
+        # draining first so the byte stream stays framed; the receiver just
+        # sees it as a duplicate chunk.
+        nonlocal next_seq, next_offset
+        next_seq = base_seq
+        next_offset = base_offset
+        in_flight.clear()
+
+    try:
+        while base_offset < size:
+            want_write = pending_hdr is not None or pending_rem or (
+                next_offset < size and len(in_flight) < WINDOW_SIZE
+            )
+            sel.modify(sock, selectors.EVENT_READ |
+                       (selectors.EVENT_WRITE if want_write else 0))
+            events = sel.select(timeout=RETX_TIMEOUT / 2)
+            now = time.time()
+
+            for _, mask in events:
+                if mask & selectors.EVENT_READ:
+                    data = sock.recv(4096)
+                    if not data:
+                        raise ConnectionError("Socket closed while awaiting ACKs")
+                    ack_buf += data
+                    while len(ack_buf) >= ACK_SIZE:
+                        ack_tag, ack_seq = _ACK.unpack_from(ack_buf)
+                        del ack_buf[:ACK_SIZE]
+                        if ack_tag != b"ACK!":
+                            raise RuntimeError("Bad ACK tag")
+                        replies_seen += 1
+                        if ack_seq == 0xFFFFFFFF:
+                            # Explicit NACK: resend from the window base.
+                            # Stale cumulative ACKs (seq < base_seq) are just
+                            # replies to retransmitted duplicates -- ignore
+                            # them, per Go-Back-N.
+                            print(f"[retx] NACK at base seq {base_seq}; rewinding")
+                            rewind()
+                            continue
+                        # Cumulative advance over contiguous acked chunks
+                        while base_seq <= ack_seq and base_seq in in_flight:
+                            off, length, _ = in_flight.pop(base_seq)
+                            base_offset = off + length
+                            base_seq += 1
+
+                if mask & selectors.EVENT_WRITE:
+                    while True:
+                        if pending_hdr is None and not pending_rem:
+                            if next_offset >= size or len(in_flight) >= WINDOW_SIZE:
+                                break
+                            length = min(CHUNK_SIZE, size - next_offset)
+                            _prefetch(mm, next_offset + length, size)
+                            _build_chunk(hdr_buf, mm_view, next_seq, next_offset, length)
+                            pending_hdr = hdr_view
+                            pending_off = next_offset
+                            pending_rem = length
+                            in_flight[next_seq] = (next_offset, length, now)
+                            next_seq += 1
+                            next_offset += length
+                        try:
+                            if pending_hdr is not None:
+                                n = sock.send(pending_hdr)
+                                pending_hdr = pending_hdr[n:] if n < len(pending_hdr) else None
+                                if pending_hdr is not None:
+                                    break  # kernel send buffer is full
+                            if pending_rem:
+                                n = _send_payload(sock, f, mm_view, pending_off, pending_rem)
+                                pending_off += n
+                                pending_rem -= n
+                                if pending_rem:
+                                    break
+                            frames_sent += 1
+                        except (BlockingIOError, InterruptedError):
+                            break
+
+            # Retransmit timer on the oldest in-flight chunk
+            if in_flight and now - in_flight[base_seq][2] > RETX_TIMEOUT:
+                print(f"[retx] seq {base_seq} timed out; rewinding window")
+                rewind()
+
+        # Everything is acked, but each retransmitted duplicate still owes
+        # us one stale reply frame. Drain them now so the next bytes on the
+        # stream are the DONE_OK line, not leftover ACKs.
+        sock.settimeout(SOCKET_TIMEOUT)
+        while replies_seen < frames_sent:
+            while len(ack_buf) >= ACK_SIZE and replies_seen < frames_sent:
+                ack_tag, _ = _ACK.unpack_from(ack_buf)
+                del ack_buf[:ACK_SIZE]
+                if ack_tag != b"ACK!":
+                    raise RuntimeError("Bad ACK tag")
+                replies_seen += 1
+            if replies_seen < frames_sent:
+                data = sock.recv(4096)
+                if not data:
+                    raise ConnectionError("Socket closed while draining ACKs")
+                ack_buf += data
+    finally:
+        if hasattr(socket, "TCP_CORK"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+        sel.unregister(sock)
+        sel.close()
+        sock.settimeout(SOCKET_TIMEOUT)
+
+    return next_seq
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
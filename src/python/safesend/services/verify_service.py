@@ -0,0 +1,49 @@
+# src/python/safesend/services/verify_service.py
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from ..malware_scan import scan_file
+from ..util.hashing import sha256_file
+
+_MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+class VerifyService:
+    """
+    Shared worker pool for the heavy end-of-transfer steps: SHA-256 digests
+    and malware scans.
+
+    With many concurrent transfers, each connection verifying inline
+    serializes on its own thread. Submitting to one pool lets N digests run
+    on N cores (hashlib releases the GIL for large updates) and caps how
+    much verification work can pile onto the box at once. A SIMD
+    multi-buffer hash would batch further still, but needs a native
+    extension; this gets the same per-core parallelism with stdlib.
+    """
+
+    def __init__(self, max_workers: int = _MAX_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix="verify")
+
+    def submit_digest(self, path):
+        """Schedule a SHA-256 of the file; returns a Future of the hexdigest."""
+        return self._pool.submit(sha256_file, path)
+
+    def submit_scan(self, path):
+        """Schedule a malware scan; returns a Future of (infected, message)."""
+        return self._pool.submit(scan_file, path)
+
+    def verify(self, path):
+        """Digest and scan the file concurrently; returns (sha256, infected, message)."""
+        digest_f = self.submit_digest(path)
+        scan_f = self.submit_scan(path)
+        infected, msg = scan_f.result()
+        return digest_f.result(), infected, msg
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+# One pool per process; receiver threads all feed it.
+_default = VerifyService()
+submit_digest = _default.submit_digest
+submit_scan = _default.submit_scan
+verify = _default.verify
@@ -1,4 +1,115 @@
+import ctypes
+import ctypes.util
+import platform
 import zlib
 
-def crc32_bytes(data: bytes) -> int:
-    return zlib.crc32(data) & 0xFFFFFFFF
+# zlib's crc32 is the portable table-driven implementation (~1-4 GB/s).
+# libdeflate's crc32 uses PCLMULQDQ folding on x86 (Intel's "Fast CRC
+# Computation Using PCLMULQDQ" scheme, 15+ GB/s) and the ARMv8 CRC32
+# instructions on aarch64 (~3+ GB/s; these compute the Ethernet CRC-32
+# polynomial we need, not CRC32C). libdeflate picks the right code path
+# itself via cpuid/hwcaps, so we just bind it with ctypes when the shared
+# library is around and fall back to zlib otherwise.
+
+_AT_HWCAP = 16
+_HWCAP_CRC32 = 1 << 7  # aarch64 hwcap bit for the CRC32 instructions
+
+def _aarch64_has_crc32() -> bool:
+    try:
+        libc = ctypes.CDLL(None)
+        libc.getauxval.restype = ctypes.c_ulong
+        libc.getauxval.argtypes = (ctypes.c_ulong,)
+        return bool(libc.getauxval(_AT_HWCAP) & _HWCAP_CRC32)
+    except (OSError, AttributeError):
+        return False
+
+def _load_libdeflate():
+    machine = platform.machine()
+    if machine in ("x86_64", "AMD64"):
+        pass
+    elif machine == "aarch64":
+        # Without the CRC32 instructions libdeflate's generic path is no
+        # better than zlib, so don't bother binding it.
+        if not _aarch64_has_crc32():
+            return None
+    else:
+        return None
+    name = ctypes.util.find_library("deflate")
+    if not name:
+        return None
+    try:
+        lib = ctypes.CDLL(name)
+        lib.libdeflate_crc32.restype = ctypes.c_uint32
+        lib.libdeflate_crc32.argtypes = (ctypes.c_uint32, ctypes.c_void_p, ctypes.c_size_t)
+        return lib
+    except (OSError, AttributeError):
+        return None
+
+def _load_zlib_ng():
+    # zlib-ng's table-less Chorba fallback is ~2x stock zlib on machines
+    # with neither PCLMUL nor ARMv8 CRC32, and its native API is a drop-in
+    # ctypes bind just like libdeflate's.
+    name = ctypes.util.find_library("z-ng")
+    if not name:
+        return None
+    try:
+        lib = ctypes.CDLL(name)
+        lib.zng_crc32.restype = ctypes.c_uint32
+        lib.zng_crc32.argtypes = (ctypes.c_uint32, ctypes.c_void_p, ctypes.c_size_t)
+        return lib
+    except (OSError, AttributeError):
+        return None
+
+_libdeflate = _load_libdeflate()
+_zlib_ng = _load_zlib_ng()
+
+def _as_c_buffer(data, n: int):
+    """ctypes-passable view of the data, or None where wrapping would need a
+    copy (read-only buffers such as mmap views -- zlib takes those as-is)."""
+    if isinstance(data, bytes):
+        return data
+    try:
+        return (ctypes.c_char * n).from_buffer(data)
+    except TypeError:
+        return None
+
+def _crc32_libdeflate(data, crc: int = 0) -> int:
+    n = len(data)
+    buf = _as_c_buffer(data, n)
+    if buf is None:
+        return zlib.crc32(data, crc) & 0xFFFFFFFF
+    return _libdeflate.libdeflate_crc32(crc, buf, n)
+
+def _crc32_zlib_ng(data, crc: int = 0) -> int:
+    n = len(data)
+    buf = _as_c_buffer(data, n)
+    if buf is None:
+        return zlib.crc32(data, crc) & 0xFFFFFFFF
+    return _zlib_ng.zng_crc32(crc, buf, n)
+
+def _crc32_zlib(data, crc: int = 0) -> int:
+    return zlib.crc32(data, crc) & 0xFFFFFFFF
+
+# Dispatch order: hardware CRC (libdeflate) -> Chorba (zlib-ng) -> zlib.
+if _libdeflate is not None:
+    _crc32_impl = _crc32_libdeflate
+elif _zlib_ng is not None:
+    _crc32_impl = _crc32_zlib_ng
+else:
+    _crc32_impl = _crc32_zlib
+
+def crc32_bytes(data) -> int:
+    """
+    CRC32 of any buffer-protocol object: bytes, bytearray, memoryview,
+    mmap slice. On hot paths pass a view of the data you already have --
+    materializing a bytes object first just adds a memcpy.
+    """
+    return _crc32_impl(data)
+
+def crc32_update(data, crc: int = 0) -> int:
+    """
+    Fold `data` into a running CRC32 (zlib.crc32-style continuation), so a
+    chunk can be checksummed piecewise as it streams in instead of in one
+    pass at the end.
+    """
+    return _crc32_impl(data, crc)
@@ -2,8 +2,15 @@ import hashlib
 from pathlib import Path
 
 def sha256_file(path: str | Path) -> str:
-    h = hashlib.sha256()
+    # hashlib's sha256 comes from OpenSSL, which already dispatches to the
+    # SHA-NI instructions on x86 (and the ARMv8 sha2 extensions) at runtime,
+    # so the digest itself runs at multi-GB/s. What remains is the Python
+    # read loop: file_digest (3.11+) drives it in C with a single reused
+    # buffer and no per-block bytes objects.
     with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        h = hashlib.sha256()
         for chunk in iter(lambda: f.read(1024 * 1024), b""):
             h.update(chunk)
-    return h.hexdigest()
+        return h.hexdigest()
@@ -0,0 +1,70 @@
+# src/python/safesend/util/netio.py
+import socket
+
+# 16 MiB socket buffers: default rmem/wmem (~128-256 KiB) can't hold one
+# bandwidth-delay product on a long fat pipe, which caps throughput no
+# matter how fast the endpoints are. The kernel clamps these to its
+# rmem_max/wmem_max, so over-asking is safe.
+HIGH_THROUGHPUT_RCV_BUFFER = 16 * 1024 * 1024
+HIGH_THROUGHPUT_SND_BUFFER = 16 * 1024 * 1024
+
+def tune_transfer_socket(sock: socket.socket):
+    """Apply high-throughput TCP settings to a connected transfer socket."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, HIGH_THROUGHPUT_RCV_BUFFER)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, HIGH_THROUGHPUT_SND_BUFFER)
+    # Nagle would hold back the small ACK/control writes once sends are pipelined
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_QUICKACK"):  # Linux only
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        except OSError:
+            pass
+
+class BufferedSocket:
+    """
+    Buffered reader over a TCP socket.
+
+    recv_line-style per-byte reads cost one syscall and one bytes object per
+    character; this pulls up to `bufsize` bytes per recv into a reusable
+    bytearray (via recv_into, no per-read allocation) and serves lines and
+    fixed-size frames out of it.
+    """
+
+    def __init__(self, sock: socket.socket, bufsize: int = 4096):
+        self.sock = sock
+        self._buf = bytearray(bufsize)
+        self._mv = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def _fill(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buf):
+            if self._start > 0:
+                # Compact pending bytes to the front to make room.
+                pending = self._end - self._start
+                self._buf[0:pending] = self._buf[self._start:self._end]
+                self._start, self._end = 0, pending
+            else:
+                # A single line outgrew the buffer; double it. The view must
+                # be released first -- a bytearray with live exports cannot
+                # be resized.
+                self._mv.release()
+                self._buf.extend(bytes(len(self._buf)))
+                self._mv = memoryview(self._buf)
+        n = self.sock.recv_into(self._mv[self._end:])
+        if n == 0:
+            raise ConnectionError("Socket closed while reading")
+        self._end += n
+
+    def readline(self) -> bytes:
+        """Read up to and including the next newline; returns the line without it."""
+        while True:
+            i = self._buf.find(b"\n", self._start, self._end)
+            if i >= 0:
+                line = bytes(self._mv[self._start:i])
+                self._start = i + 1
+                return line
+            self._fill()